@@ -1,9 +1,11 @@
 from flask import Flask, render_template, request, jsonify, Response
+import base64
 import cv2
 import os
 from werkzeug.utils import secure_filename
-from pose_utils import PoseAnalyzer, SitUpAnalyzer
+from pose_utils import PipelinedPoseRunner, PoseAnalyzer, SitUpAnalyzer
 import json
+import threading
 from datetime import datetime
 import logging
 
@@ -20,9 +22,28 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 # Global variables for video processing
 current_video_path = None
-processing = False
+processing = threading.Event()  # set while a video is streaming
 analyzer = SitUpAnalyzer()
 pose_analyzer = PoseAnalyzer()
+# Guards analyzer between the processing stream and the request handlers
+analyzer_lock = threading.Lock()
+
+# Frame pipeline settings
+PIPELINE_QUEUE_SIZE = 8
+JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 75, cv2.IMWRITE_JPEG_OPTIMIZE, 0]
+
+
+class _JsonCache:
+    """Serialize a value only when it differs from the last one seen."""
+    def __init__(self):
+        self.value = None
+        self.text = None
+
+    def dumps(self, value):
+        if self.text is None or value != self.value:
+            self.value, self.text = value, json.dumps(value)
+        return self.text
+
 
 @app.route('/')
 def index():
@@ -30,7 +51,7 @@ def index():
 
 @app.route('/upload', methods=['POST'])
 def upload_video():
-    global current_video_path, processing, analyzer
+    global current_video_path
     
     if 'video' not in request.files:
         return jsonify({'error': 'No video file provided'}), 400
@@ -41,7 +62,9 @@ def upload_video():
     
     if file:
         # Reset analyzer for new video
-        analyzer = SitUpAnalyzer()
+        with analyzer_lock:
+            analyzer.reset_counts()
+            analyzer.reset_state()
         
         # Save the uploaded file
         filename = secure_filename(file.filename)
@@ -54,19 +77,19 @@ def upload_video():
 
 @app.route('/process')
 def process_video():
-    global current_video_path, processing, analyzer, pose_analyzer
+    global current_video_path, analyzer, pose_analyzer
     
     if not current_video_path or not os.path.exists(current_video_path):
         return jsonify({'error': 'No video available for processing'}), 400
     
     def generate_frames():
-        global processing, analyzer, pose_analyzer
+        global analyzer, pose_analyzer
 
-        processing = True
         cap = cv2.VideoCapture(current_video_path)
         if not cap.isOpened():
             yield "data: {\"error\": \"Could not open video\"}\n\n"
             return
+        processing.set()
 
         fps = cap.get(cv2.CAP_PROP_FPS)
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
@@ -75,18 +98,16 @@ def process_video():
 
         frame_count = 0
 
-        while processing and cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            # Pose detection
-            keypoints, results = pose_analyzer.get_keypoints(frame)
+        def annotate_frame(frame, keypoints, results):
+            # Runs on the runner's analysis thread; other readers take analyzer_lock
+            nonlocal frame_count
 
             # Sit-up analysis
-            torso_angle = analyzer.analyze_situp(keypoints, frame.shape)
-            feedback = analyzer.last_feedback  # comes from analyzer state
-            counts = analyzer.get_counts()
+            with analyzer_lock:
+                torso_angle = analyzer.analyze_situp(keypoints, frame.shape)
+                feedback = analyzer.last_feedback  # comes from analyzer state
+                counts = analyzer.get_counts()
+                debug_data = analyzer.get_debug_info()
 
             # Draw landmarks
             frame = pose_analyzer.draw_landmarks(frame, results)
@@ -103,18 +124,12 @@ def process_video():
                             cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
 
             # Debug info
-            debug_info = f"Keypoints: {len(keypoints)}" if keypoints else "No pose detected"
+            debug_info = f"Keypoints: {len(keypoints)}" if keypoints is not None else "No pose detected"
             cv2.putText(frame, debug_info, (10, 190),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
 
-            # Encode frame
-            ret, buffer = cv2.imencode('.jpg', frame)
-            frame_bytes = buffer.tobytes()
-
             # Build data packet
-            debug_data = analyzer.get_debug_info()
             data = {
-                'frame': frame_bytes.hex(),
                 'counts': counts,
                 'feedback': feedback,
                 'angle': round(torso_angle, 1) if torso_angle else None,
@@ -122,12 +137,32 @@ def process_video():
                 'debug': debug_info,
                 'debug_data': debug_data
             }
-
-            yield f"data: {json.dumps(data)}\n\n"
             frame_count += 1
-
-        cap.release()
-        processing = False
+            return frame, data
+
+        # Capture, pose inference and analysis run on the runner's threads;
+        # JPEG encoding here overlaps with them
+        runner = PipelinedPoseRunner(cap, pose_analyzer, annotate_frame,
+                                     keep_running=processing.is_set,
+                                     queue_size=PIPELINE_QUEUE_SIZE)
+        # counts and debug_data only change around rep boundaries
+        counts_cache, debug_cache = _JsonCache(), _JsonCache()
+        try:
+            for frame, data in runner:
+                counts_json = counts_cache.dumps(data.pop('counts'))
+                debug_json = debug_cache.dumps(data.pop('debug_data'))
+
+                # Encode frame; base64 needs no JSON escaping, so it is
+                # spliced into the serialized packet instead of re-escaped
+                ret, buffer = cv2.imencode('.jpg', frame, JPEG_PARAMS)
+                frame_b64 = base64.b64encode(buffer).decode('ascii')
+                yield (f'data: {{"frame": "{frame_b64}", "counts": {counts_json}, '
+                       f'"debug_data": {debug_json}, {json.dumps(data)[1:]}\n\n')
+        finally:
+            # Also reached when the client disconnects mid-stream
+            runner.close()
+            cap.release()
+            processing.clear()
 
         final_counts = analyzer.get_counts()
         yield f"data: {json.dumps({'completed': True, 'final_results': final_counts})}\n\n"
@@ -153,7 +188,8 @@ def get_detailed_results():
 def reset_counts():
     """Reset all counters"""
     global analyzer
-    analyzer.reset_counts()
+    with analyzer_lock:
+        analyzer.reset_counts()
     return jsonify({'message': 'Counts reset successfully'})
 
 @app.route('/export_results')
@@ -184,8 +220,7 @@ def export_results():
 
 @app.route('/stop')
 def stop_processing():
-    global processing
-    processing = False
+    processing.clear()
     return jsonify({'message': 'Processing stopped'})
 
 if __name__ == '__main__':
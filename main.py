@@ -2,7 +2,31 @@ import cv2
 import argparse
 import json
 from tqdm import tqdm
-from pose_utils import PoseAnalyzer, SitUpAnalyzer
+from pose_utils import PipelinedPoseRunner, PoseAnalyzer, SitUpAnalyzer
+
+class GpuVideoWriter:
+    """cv2.VideoWriter-style wrapper around the CUDA (NVENC) H.264 encoder."""
+    def __init__(self, output_path, fps, frame_size):
+        self.writer = cv2.cudacodec.createVideoWriter(
+            output_path, frame_size, cv2.cudacodec.H264, fps)
+        self.gpu_frame = cv2.cuda_GpuMat()
+
+    def write(self, frame):
+        self.gpu_frame.upload(frame)
+        self.writer.write(self.gpu_frame)
+
+    def release(self):
+        self.writer.release()
+
+def open_video_writer(output_path, fps, width, height):
+    """Open a hardware encoder when OpenCV has CUDA, else the CPU mp4v writer."""
+    if hasattr(cv2, 'cudacodec') and cv2.cuda.getCudaEnabledDeviceCount() > 0:
+        try:
+            return GpuVideoWriter(output_path, fps, (width, height))
+        except cv2.error as e:
+            print(f"Hardware encoder unavailable, using CPU encoder: {e}")
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    return cv2.VideoWriter(output_path, fourcc, fps, (width, height))
 
 def process_video(input_path, output_path=None):
     """Process video and count sit-ups"""
@@ -20,33 +44,22 @@ def process_video(input_path, output_path=None):
     
     # Initialize video writer if output path is provided
     if output_path:
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+        out = open_video_writer(output_path, fps, width, height)
     
-    # Initialize analyzers
-    pose_analyzer = PoseAnalyzer()
+    # Initialize analyzers; frames are only annotated when they get written,
+    # and offline processing doesn't need display smoothing
+    pose_analyzer = PoseAnalyzer(smooth_landmarks=False, draw=bool(output_path))
     situp_analyzer = SitUpAnalyzer()
     
-    # Process video frame by frame
-    frame_count = 0
-    feedback_text = "Starting analysis..."
-    
-    for _ in tqdm(range(total_frames), desc="Processing video"):
-        ret, frame = cap.read()
-        if not ret:
-            break
-            
-        # Analyze pose
-        landmarks = pose_analyzer.analyze_frame(frame)
-        keypoints = pose_analyzer.get_landmark_coordinates(landmarks, frame.shape)
-        
+    def annotate_frame(frame, keypoints, pose_results):
         # Analyze sit-up
-        feedback, rep_completed = situp_analyzer.analyze_situp(keypoints, frame.shape)
-        feedback_text = feedback
+        situp_analyzer.analyze_situp(keypoints, frame.shape)
+        feedback_text = situp_analyzer.last_feedback
+        if not pose_analyzer.draw_enabled:
+            return frame
         
         # Draw landmarks and feedback
-        if landmarks:
-            frame = pose_analyzer.draw_landmarks(frame, landmarks)
+        frame = pose_analyzer.draw_landmarks(frame, pose_results)
         
         # Display counts and feedback
         counts = situp_analyzer.get_counts()
@@ -56,7 +69,13 @@ def process_video(input_path, output_path=None):
                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
         cv2.putText(frame, feedback_text, (10, 110), 
                    cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-        
+        return frame
+    
+    # Process video with capture, pose inference and analysis overlapped
+    frame_count = 0
+    runner = PipelinedPoseRunner(cap, pose_analyzer, annotate_frame)
+    
+    for frame in tqdm(runner, total=total_frames, desc="Processing video"):
         # Write frame to output video if specified
         if output_path:
             out.write(frame)
@@ -1,111 +1,289 @@
+import logging
+import math
+import queue
+import threading
 import cv2
 import mediapipe as mp
 import numpy as np
-from enum import Enum
+from enum import IntEnum
 
-class PoseState(Enum):
+logger = logging.getLogger(__name__)
+
+class PoseState(IntEnum):
     UP = 1
     DOWN = 2
     UNKNOWN = 3
 
+# Plain ints for the per-frame state machine, and their names for debug info
+_UP = int(PoseState.UP)
+_DOWN = int(PoseState.DOWN)
+_STATE_NAMES = {state.value: state.name for state in PoseState}
+
+def calculate_angle(a, b, c):
+    """Calculate angle between 3 points (a-b-c), in degrees."""
+    radians = math.atan2(c[1] - b[1], c[0] - b[0]) - math.atan2(a[1] - b[1], a[0] - b[0])
+    angle = abs(radians) * 57.29577951308232
+    return angle if angle <= 180.0 else 360.0 - angle
+
+def _situp_angle(keypoints, w, h):
+    """Shoulder-hip-knee angle (landmarks 11, 23, 25) in degrees."""
+    (sx, sy), (hx, hy), (kx, ky) = keypoints[(11, 23, 25), :2].tolist()
+    return calculate_angle((sx * w, sy * h), (hx * w, hy * h), (kx * w, ky * h))
+
 class PoseAnalyzer:
-    def __init__(self, detection_conf=0.5, tracking_conf=0.5):
+    def __init__(self, detection_conf=0.5, tracking_conf=0.5, model_complexity=0,
+                 input_width=384, smooth_landmarks=True, draw=True):
         self.mp_pose = mp.solutions.pose
-        self.pose = self.mp_pose.Pose(
+        # Lite model with frame-to-frame tracking, so the person detector only
+        # reruns when tracking is lost; no segmentation mask is needed
+        pose_options = dict(
+            static_image_mode=False,
+            smooth_landmarks=smooth_landmarks,
+            enable_segmentation=False,
             min_detection_confidence=detection_conf,
             min_tracking_confidence=tracking_conf
         )
+        try:
+            self.pose = self.mp_pose.Pose(model_complexity=model_complexity, **pose_options)
+        except OSError as e:
+            # Only the full model ships in the mediapipe wheel; the lite one is
+            # downloaded into site-packages on first use, which fails offline
+            # or on a read-only install
+            if model_complexity != 0:
+                raise
+            logger.warning("Lite pose model unavailable (%s); using model_complexity=1", e)
+            self.pose = self.mp_pose.Pose(model_complexity=1, **pose_options)
         self.mp_drawing = mp.solutions.drawing_utils
+        # Headless callers turn drawing off; draw_landmarks then does nothing
+        self.draw_enabled = draw
+        self._landmark_spec = self.mp_drawing.DrawingSpec(color=(0, 0, 255), thickness=2, circle_radius=2)
+        self._connection_spec = self.mp_drawing.DrawingSpec(color=(0, 255, 0), thickness=2, circle_radius=2)
+        # Frames wider than this are downscaled before inference; landmarks are
+        # normalized, so they still map onto the full-size frame
+        self.input_width = input_width
+        # Reused resize and RGB buffers so preprocessing doesn't allocate per frame
+        self._small_buf = None
+        self._rgb_buf = None
+        # Landmarks as rows of (x, y, z, visibility), refilled every frame
+        self._keypoints = np.empty((33, 4), np.float32)
 
     def get_keypoints(self, image):
-        """Extract pose landmarks from image."""
-        results = self.pose.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-        keypoints = {}
+        """Extract pose landmarks from image.
+
+        Returns a (33, 4) float32 array of normalized x, y, z and visibility,
+        or None when no pose is found, plus the raw MediaPipe results. The
+        array is reused, so it is only valid until the next call.
+        """
+        self._rgb_buf = self.prepare(image, self._rgb_buf)
+        return self.detect(self._rgb_buf)
+
+    def prepare(self, image, out=None):
+        """Downscale and convert a BGR frame into the RGB inference input.
+
+        The result is written into `out` when it has the right shape, else a
+        new array is returned.
+        """
+        h, w = image.shape[:2]
+        if w > self.input_width:
+            small_h = round(h * self.input_width / w)
+            if self._small_buf is None or self._small_buf.shape[:2] != (small_h, self.input_width):
+                self._small_buf = np.empty((small_h, self.input_width, 3), np.uint8)
+            image = cv2.resize(image, (self.input_width, small_h), dst=self._small_buf,
+                               interpolation=cv2.INTER_AREA)
+        if out is None or out.shape != image.shape:
+            out = np.empty_like(image)
+        out.flags.writeable = True
+        cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=out)
+        # Read-only input lets MediaPipe wrap the buffer instead of copying it
+        out.flags.writeable = False
+        return out
+
+    def detect(self, rgb):
+        """Run pose inference on a prepare() result; see get_keypoints."""
+        results = self.pose.process(rgb)
+        keypoints = None
         if results.pose_landmarks:
-            for idx, lm in enumerate(results.pose_landmarks.landmark):
-                keypoints[idx] = {
-                    'x': lm.x,
-                    'y': lm.y,
-                    'z': lm.z,
-                    'visibility': lm.visibility
-                }
+            keypoints = self._keypoints
+            keypoints[:] = [(lm.x, lm.y, lm.z, lm.visibility)
+                            for lm in results.pose_landmarks.landmark]
         return keypoints, results
 
     def draw_landmarks(self, image, results):
         """Draw pose landmarks on frame."""
-        if results.pose_landmarks:
+        if self.draw_enabled and results.pose_landmarks:
             self.mp_drawing.draw_landmarks(
                 image,
                 results.pose_landmarks,
                 self.mp_pose.POSE_CONNECTIONS,
-                self.mp_drawing.DrawingSpec(color=(0, 0, 255), thickness=2, circle_radius=2),
-                self.mp_drawing.DrawingSpec(color=(0, 255, 0), thickness=2, circle_radius=2)
+                self._landmark_spec,
+                self._connection_spec
             )
         return image
 
+_END_OF_STREAM = object()  # poison pill passed between pipeline stages
+
+def _unblock(q):
+    """Discard buffered items and leave an end marker for any waiting reader."""
+    try:
+        while True:
+            q.get_nowait()
+    except queue.Empty:
+        pass
+    try:
+        q.put_nowait(_END_OF_STREAM)
+    except queue.Full:
+        pass
+
+class PipelinedPoseRunner:
+    """Overlap frame capture, pose inference and per-frame analysis.
+
+    Three threads joined by bounded queues read and prepare frames from
+    `cap`, run pose inference, and call
+    `handle_frame(frame, keypoints, results)`. Iterating the runner yields
+    what `handle_frame` returns, in frame order. `keep_running` is checked
+    before each read; returning False ends the stream early. An exception
+    raised in any stage stops the pipeline and is re-raised by the iterator.
+    """
+    def __init__(self, cap, pose_analyzer, handle_frame, keep_running=None, queue_size=3):
+        self.cap = cap
+        self.pose_analyzer = pose_analyzer
+        self.handle_frame = handle_frame
+        self.keep_running = keep_running or (lambda: True)
+        self._frames = queue.Queue(maxsize=queue_size)
+        self._poses = queue.Queue(maxsize=queue_size)
+        self._outputs = queue.Queue(maxsize=queue_size)
+        self._stopped = threading.Event()
+        self._error = None
+        self._workers = []
+
+    def _fail(self, error):
+        # Keep the first error and stop the other stages; the end marker each
+        # stage still sends lets the iterator finish and re-raise it
+        if self._error is None:
+            self._error = error
+        self._stopped.set()
+
+    def _capture(self):
+        # Resizing and colour conversion happen here so the inference thread
+        # only runs MediaPipe. Inputs rotate through enough buffers to cover
+        # every queued frame plus the one being inferred and the one being made.
+        inputs = [None] * (self._frames.maxsize + 2)
+        slot = 0
+        try:
+            while self.keep_running() and not self._stopped.is_set():
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                inputs[slot] = self.pose_analyzer.prepare(frame, inputs[slot])
+                self._frames.put((frame, inputs[slot]))
+                slot = (slot + 1) % len(inputs)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._frames.put(_END_OF_STREAM)
+
+    def _infer(self):
+        try:
+            while not self._stopped.is_set():
+                item = self._frames.get()
+                if item is _END_OF_STREAM:
+                    break
+                frame, rgb = item
+                keypoints, results = self.pose_analyzer.detect(rgb)
+                # detect() refills the same array; the next stage needs its own
+                if keypoints is not None:
+                    keypoints = keypoints.copy()
+                self._poses.put((frame, keypoints, results))
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._poses.put(_END_OF_STREAM)
+
+    def _analyze(self):
+        try:
+            while not self._stopped.is_set():
+                item = self._poses.get()
+                if item is _END_OF_STREAM:
+                    break
+                self._outputs.put(self.handle_frame(*item))
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._outputs.put(_END_OF_STREAM)
+
+    def __iter__(self):
+        self._workers = [threading.Thread(target=stage, daemon=True)
+                         for stage in (self._capture, self._infer, self._analyze)]
+        for worker in self._workers:
+            worker.start()
+        try:
+            while True:
+                item = self._outputs.get()
+                if item is _END_OF_STREAM:
+                    break
+                yield item
+        finally:
+            self.close()
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        """Stop all stages and wait for their threads to exit."""
+        self._stopped.set()
+        for worker in self._workers:
+            while worker.is_alive():
+                # A stage may be blocked on a full or empty queue
+                for q in (self._frames, self._poses, self._outputs):
+                    _unblock(q)
+                worker.join(timeout=0.05)
+
 class SitUpAnalyzer:
     def __init__(self):
-        self.state = PoseState.DOWN
-        self.correct_count = 0
-        self.incorrect_count = 0
-        self.rep_in_progress = False
-        self.rep_data = {
-            'max_angle': 0,
-            'min_angle': 180
-        }
-        self.last_feedback = "Starting..."
-        self.missing_keypoints = []
+        self.reset_counts()
+        self.reset_state()
 
         # Thresholds
         self.UP_ANGLE_THRESHOLD = 60
         self.DOWN_ANGLE_THRESHOLD = 40
         self.CORRECT_ANGLE_RANGE = (60, 100)
 
-    def calculate_angle(self, a, b, c):
-        """Calculate angle between 3 points (a-b-c)."""
-        a, b, c = np.array(a), np.array(b), np.array(c)
-        radians = np.arctan2(c[1] - b[1], c[0] - b[0]) - \
-                  np.arctan2(a[1] - b[1], a[0] - b[0])
-        angle = np.abs(radians * 180.0 / np.pi)
-        return min(angle, 360 - angle)
-
     def analyze_situp(self, keypoints, frame_shape):
         """Process one frame and update sit-up counts."""
         h, w = frame_shape[:2]
-        required = [11, 23, 25]  # shoulder, hip, knee
-        self.missing_keypoints = [idx for idx in required if idx not in keypoints]
-
-        if self.missing_keypoints:
+        if keypoints is None:
+            self.missing_keypoints = [11, 23, 25]  # shoulder, hip, knee
             self.last_feedback = f"Missing keypoints: {self.missing_keypoints}"
             return None
+        self.missing_keypoints = []
 
-        shoulder = (keypoints[11]['x'] * w, keypoints[11]['y'] * h)
-        hip = (keypoints[23]['x'] * w, keypoints[23]['y'] * h)
-        knee = (keypoints[25]['x'] * w, keypoints[25]['y'] * h)
-
-        angle = self.calculate_angle(shoulder, hip, knee)
+        angle = _situp_angle(keypoints, w, h)
 
         # Track min/max for current rep
-        self.rep_data['max_angle'] = max(self.rep_data['max_angle'], angle)
-        self.rep_data['min_angle'] = min(self.rep_data['min_angle'], angle)
-
-        # State machine
-        if self.state == PoseState.DOWN and angle < self.UP_ANGLE_THRESHOLD:
-            self.state = PoseState.UP
-            self.rep_in_progress = True
-            self.last_feedback = "Good! Now go back down."
-        elif self.state == PoseState.UP and angle > self.DOWN_ANGLE_THRESHOLD:
-            self.state = PoseState.DOWN
-            if self.rep_in_progress:
-                self._check_form_correctness()
-                self.rep_in_progress = False
+        if angle > self._max_angle:
+            self._max_angle = angle
+        if angle < self._min_angle:
+            self._min_angle = angle
+
+        # State machine; the state is read once and only its own threshold checked
+        state = self.state
+        if state == _DOWN:
+            if angle < self.UP_ANGLE_THRESHOLD:
+                self.state = _UP
+                self.rep_in_progress = True
+                self.last_feedback = "Good! Now go back down."
+        elif state == _UP:
+            if angle > self.DOWN_ANGLE_THRESHOLD:
+                self.state = _DOWN
+                if self.rep_in_progress:
+                    self._check_form_correctness()
+                    self.rep_in_progress = False
 
         return angle
 
     def _check_form_correctness(self):
         """Check whether the rep was correct or incorrect."""
-        if self.rep_data['min_angle'] < self.CORRECT_ANGLE_RANGE[0] and \
-           self.rep_data['max_angle'] > self.CORRECT_ANGLE_RANGE[1]:
+        if self._min_angle < self.CORRECT_ANGLE_RANGE[0] and \
+           self._max_angle > self.CORRECT_ANGLE_RANGE[1]:
             self.correct_count += 1
             self.last_feedback = "Correct sit-up!"
         else:
@@ -113,17 +291,35 @@ class SitUpAnalyzer:
             self.last_feedback = "Try to maintain proper form."
 
         # Reset rep data
-        self.rep_data = {'max_angle': 0, 'min_angle': 180}
+        self._max_angle = 0.0
+        self._min_angle = 180.0
+
+    def reset_counts(self):
+        """Zero the correct/incorrect counters."""
+        self.correct_count = 0
+        self.incorrect_count = 0
+
+    def reset_state(self):
+        """Return the rep state machine to its starting position."""
+        self.state = _DOWN
+        self.rep_in_progress = False
+        self._max_angle = 0.0
+        self._min_angle = 180.0
+        self.last_feedback = "Starting..."
+        self.missing_keypoints = []
 
     def get_counts(self):
+        total = self.correct_count + self.incorrect_count
         return {
             "correct": self.correct_count,
-            "incorrect": self.incorrect_count
+            "incorrect": self.incorrect_count,
+            "total": total,
+            "accuracy": round(self.correct_count / total * 100, 1) if total else 0.0
         }
 
     def get_debug_info(self):
         return {
-            "state": self.state.name,
+            "state": _STATE_NAMES[self.state],
             "rep_in_progress": self.rep_in_progress,
             "last_feedback": self.last_feedback,
             "missing_keypoints": self.missing_keypoints
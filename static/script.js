@@ -90,18 +90,13 @@ document.addEventListener('DOMContentLoaded', function() {
             
             // Update frame
             if (data.frame) {
-                const frameBytes = new Uint8Array(data.frame.match(/.{1,2}/g).map(byte => parseInt(byte, 16)));
-                const blob = new Blob([frameBytes], {type: 'image/jpeg'});
-                const url = URL.createObjectURL(blob);
-                
                 const img = new Image();
                 img.onload = function() {
                     videoCanvas.width = img.width;
                     videoCanvas.height = img.height;
                     ctx.drawImage(img, 0, 0);
-                    URL.revokeObjectURL(url);
                 };
-                img.src = url;
+                img.src = 'data:image/jpeg;base64,' + data.frame;
             }
             
             // Update stats